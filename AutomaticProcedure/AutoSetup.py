@@ -8,7 +8,28 @@ import os
 import uuid
 import csv
 import argparse
+import re
+import socket
+import threading
+import hmac
+import hashlib
+import base64
+import binascii
+from concurrent.futures import ThreadPoolExecutor
 from git import Repo
+from uart_flashing import set_low_latency, claim_port, read_until
+
+# Console prompts, anchored to the end of the received bytes
+CONSOLE_PROMPT_RE = re.compile(rb"(?i)(?:login: |[#$] )$")
+PASSWORD_PROMPT_RE = re.compile(rb"(?i)password: ?$")
+SHELL_PROMPT_RE = re.compile(rb"[#$] $")
+ROOT_PROMPT = b"# "
+
+# "Serial\t\t: 0123456789abcdef" line of /proc/cpuinfo (not the echoed command)
+SERIAL_NUMBER_RE = re.compile(r"^Serial\s*:\s*([0-9A-Fa-f]+)", re.MULTILINE)
+
+# GNU tar --checkpoint-action=echo=%u output: one line per 1 MiB record
+TAR_CHECKPOINT_RE = re.compile(rb"tar: (\d+)$")
 
 class BoardSetup:
     def __init__(self):
@@ -30,13 +51,32 @@ class BoardSetup:
         self.image_file = os.path.join(self.base_dir, "vitro-gateway-imx6dl-crystal-emmc-3.3.1-debug.wic.gz")
         self.bmap_file = os.path.join(self.base_dir, "vitro-gateway-imx6dl-crystal-emmc-3.3.1-debug.wic.bmap")
         self.key_file = os.path.join(self.base_dir, "vitrotv_root_rsa")
+        self.image_name = os.path.basename(self.image_file)
+        self.bmap_name = os.path.basename(self.bmap_file)
+        # Filled by prepare_assets() on first use
+        self.asset_sizes = None
         self.remote_path = "/tmp/"
         self.remote_user = "root"
+        self.transfer_timeout = 1800
+        
+        # SSH connection sharing: every ssh to the Crystal reuses one master.
+        # The image is already gzipped, so compression would only burn Pi CPU
+        self.ssh_target = f"{self.remote_user}@{self.crystal_ip}"
+        self.ssh_control_path = f"/tmp/ssh-crystal-{os.getpid()}.sock"
+        self.ssh_options = [
+            "-i", self.key_file,
+            "-o", "StrictHostKeyChecking=no",
+            "-o", "Compression=no",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.ssh_control_path}",
+            "-o", "ControlPersist=300"
+        ]
         
         # UART configuration
         self.uart_device = "/dev/ttyAMA0"
         self.uart_baudrate = 115200
-        self.uart_timeout = 1
+        # Short read timeout doubles as the inter-byte idle gap that ends a reply
+        self.uart_timeout = 0.1
         
         # Credentials
         self.crystal_login = "root"
@@ -51,41 +91,70 @@ class BoardSetup:
     def cleanup_ssh_known_hosts(self):
         """Remove old SSH known hosts entries for the Crystal board"""
         self.logger.info("Cleaning up SSH known hosts...")
-        cleanup_command = f"ssh-keygen -f \"$HOME/.ssh/known_hosts\" -R \"{self.crystal_ip}\" 2>/dev/null || true"
-        self.run_command(cleanup_command)
+        known_hosts = os.path.expanduser("~/.ssh/known_hosts")
+        if not self.known_hosts_has_entry(known_hosts, self.crystal_ip):
+            return
+        success, output = self.run_command(["ssh-keygen", "-f", known_hosts, "-R", self.crystal_ip])
+        if not success:
+            self.logger.warning(f"Failed to remove old known hosts entry for {self.crystal_ip}: {output.decode(errors='replace').strip()}")
+
+    def known_hosts_has_entry(self, known_hosts, host):
+        """Check known_hosts for host, including hashed entries, without running ssh-keygen"""
+        try:
+            with open(known_hosts, 'rb') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return False
+        
+        host_bytes = host.encode()
+        for line in lines:
+            fields = line.split()
+            if not fields or fields[0].startswith(b"#"):
+                continue
+            hosts_field = fields[1] if fields[0].startswith(b"@") and len(fields) > 1 else fields[0]
+            if hosts_field.startswith(b"|1|"):
+                # HashKnownHosts format: |1|base64(salt)|base64(HMAC-SHA1(salt, host))
+                try:
+                    _, _, salt, digest = hosts_field.split(b"|", 3)
+                    expected = hmac.new(base64.b64decode(salt), host_bytes, hashlib.sha1).digest()
+                    if hmac.compare_digest(expected, base64.b64decode(digest)):
+                        return True
+                except (ValueError, binascii.Error):
+                    continue
+            elif host_bytes in hosts_field.split(b","):
+                return True
+        return False
 
-    def run_command(self, command):
-        """Execute a shell command and return the result"""
+    def run_command(self, argv):
+        """Execute a command given as an argument list (no shell) and return the raw output bytes"""
         try:
             result = subprocess.run(
-                command,
-                shell=True,
+                argv,
                 check=True,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+                stderr=subprocess.PIPE
             )
             return True, result.stdout
         except subprocess.CalledProcessError as e:
             return False, e.stderr
+        except OSError as e:
+            return False, str(e).encode()
 
     def setup_raspi_network(self):
         """Configure network on Raspberry Pi"""
         self.logger.info("Configuring Raspberry Pi network...")
         
-        # First, remove existing IP if present
-        if not self.remove_ip(self.raspi_ip, self.interface):
-            return False
-            
+        # "replace" assigns the address whether or not it is already present,
+        # so no separate show/del round-trip is needed
         commands = [
-            f"sudo ip addr add {self.raspi_ip}/{self.netmask} dev {self.interface}",
-            f"sudo ip link set {self.interface} up"
+            ["sudo", "ip", "addr", "replace", f"{self.raspi_ip}/{self.netmask}", "dev", self.interface],
+            ["sudo", "ip", "link", "set", self.interface, "up"]
         ]
         
         for cmd in commands:
             success, output = self.run_command(cmd)
             if not success:
-                self.logger.error(f"Failed to configure Raspberry Pi network: {output}")
+                self.logger.error(f"Failed to configure Raspberry Pi network: {output.decode(errors='replace')}")
                 return False
         
         self.logger.info("Raspberry Pi network configuration completed")
@@ -95,14 +164,27 @@ class BoardSetup:
         """Setup UART connection to Crystal board"""
         self.logger.info("Setting up UART connection...")
         try:
-            self.uart = serial.Serial(
-                port=self.uart_device,
-                baudrate=self.uart_baudrate,
-                timeout=self.uart_timeout
-            )
-            # Send a newline and wait briefly to ensure connection is ready
+            # Reuse a port that is already open; only the wake-up check is repeated
+            if self.uart is None or not self.uart.is_open:
+                self.uart = serial.Serial(
+                    port=self.uart_device,
+                    baudrate=self.uart_baudrate,
+                    timeout=self.uart_timeout,
+                    write_timeout=2,
+                    exclusive=True,
+                    rtscts=False,
+                    dsrdtr=False,
+                    xonxoff=False
+                )
+                if not claim_port(self.uart, self.logger):
+                    self.uart.close()
+                    return False
+                set_low_latency(self.uart, self.logger)
+            
+            # Send a newline and drain the console's answer; the read returns
+            # once the line goes idle instead of always sleeping
             self.uart.write(b"\n")
-            time.sleep(0.5)
+            self.read_uart_response(timeout=0.5)
             self.uart.reset_input_buffer()
             self.uart.reset_output_buffer()
             
@@ -112,14 +194,18 @@ class BoardSetup:
             self.logger.error(f"Failed to setup UART connection: {e}")
             return False
 
-    def send_uart_command(self, command, wait_time=1):
-        """Send command through UART and wait for response"""
+    def send_uart_command(self, command, wait_time=1, expect=None):
+        """Send command through UART and return its response, waiting at most wait_time seconds.
+        With expect, reading stops as soon as those bytes (e.g. the shell prompt) arrive."""
         try:
             self.logger.debug(f"Sending UART command: {command}")
             self.uart.write(f"{command}\n".encode())
-            time.sleep(wait_time)
             
-            response = self.uart.read_all().decode()
+            if expect:
+                response = read_until(self.uart, expect, wait_time)
+            else:
+                response = self.read_uart_response(wait_time)
+            response = response.decode(errors='ignore')
             if response:
                 self.logger.debug(f"Received response: {response.strip()}")
             else:
@@ -136,42 +222,69 @@ class BoardSetup:
             self.logger.error(f"Failed to send UART command: {e}")
             return None
 
+    def read_uart_response(self, timeout):
+        """Read UART until the line goes idle after the reply starts, or timeout expires"""
+        deadline = time.time() + timeout
+        buffer = bytearray()
+        while time.time() < deadline:
+            # Blocks for at most uart_timeout when the line is idle
+            chunk = self.uart.read(self.uart.in_waiting or 1)
+            if chunk:
+                buffer += chunk
+            elif buffer:
+                # A full read timeout passed without new bytes: reply complete
+                break
+        return bytes(buffer)
+
+    def wait_for_uart_pattern(self, pattern, timeout):
+        """Read UART until pattern matches at an idle line or timeout expires.
+        A prompt waits for input, so a match is only accepted once no further
+        bytes follow it; text that merely passes by (e.g. "Last login: ") is skipped."""
+        deadline = time.time() + timeout
+        buffer = bytearray()
+        match = None
+        while time.time() < deadline:
+            # Blocks for at most uart_timeout when the line is idle
+            chunk = self.uart.read(self.uart.in_waiting or 1)
+            if not chunk:
+                if match:
+                    return match
+                continue
+            buffer += chunk
+            
+            # Only the tail can still complete a match; cap memory on long outputs
+            del buffer[:-4096]
+            
+            # Earlier bytes were already scanned; keep a small overlap so a
+            # match straddling two reads is still found. New bytes after a
+            # candidate prompt replace it with whatever the tail matches now
+            match = pattern.search(buffer, max(0, len(buffer) - len(chunk) - 32))
+        return None
+
     def attempt_login(self):
         """Attempt to login to Crystal board via UART"""
         self.logger.info("Attempting to login to Crystal board...")
         
-        # Send initial newline to clear any pending input
-        self.uart.write(b"\n")
-        time.sleep(1)
+        # Send initial newline and wait for the console to answer with a prompt
         self.uart.reset_input_buffer()
-        self.uart.reset_output_buffer()
-        
-        # Wait for login prompt
-        time.sleep(2)
+        self.uart.write(b"\n")
+        match = self.wait_for_uart_pattern(CONSOLE_PROMPT_RE, timeout=3)
+        if match and SHELL_PROMPT_RE.search(match.group(0)):
+            self.logger.info("Crystal board console is already logged in")
+            return True
         
-        # Send login
+        # Send login and wait for the password prompt
         self.logger.debug("Sending login...")
-        response = self.send_uart_command(self.crystal_login, wait_time=2)
-        if not response:
-            self.logger.error("No response received after sending login")
+        self.uart.write(f"{self.crystal_login}\n".encode())
+        if not self.wait_for_uart_pattern(PASSWORD_PROMPT_RE, timeout=5):
+            self.logger.error("No password prompt received after sending login")
             return False
         
-        # Wait before sending password
-        time.sleep(1)
-        
-        # Send password
+        # Send password and wait for either a shell or another login prompt
         self.logger.debug("Sending password...")
-        response = self.send_uart_command(self.crystal_password, wait_time=2)
-        if not response:
-            self.logger.error("No response received after sending password")
-            return False
-        
-        # Wait for login to complete
-        time.sleep(2)
-        
-        # Send another newline to verify we're logged in
-        response = self.send_uart_command("")
-        if response and ("login" in response.lower() or "password" in response.lower()):
+        self.uart.write(f"{self.crystal_password}\n".encode())
+        match = self.wait_for_uart_pattern(CONSOLE_PROMPT_RE, timeout=10)
+        if not match or not SHELL_PROMPT_RE.search(match.group(0)):
             self.logger.error("Login failed - system still requesting credentials")
             return False
             
@@ -194,7 +307,7 @@ class BoardSetup:
         ]
         
         for cmd in commands:
-            response = self.send_uart_command(cmd, wait_time=2)
+            response = self.send_uart_command(cmd, wait_time=2, expect=ROOT_PROMPT)
             if not response:
                 self.logger.error("Failed to configure Crystal network")
                 return False
@@ -206,150 +319,244 @@ class BoardSetup:
         """Test network connection between Raspberry Pi and Crystal"""
         self.logger.info("Testing network connection...")
         
-        # Test ping from Raspberry Pi to Crystal
-        success, output = self.run_command(f"ping -c 3 {self.crystal_ip}")
-        if not success:
-            self.logger.error("Failed to ping Crystal from Raspberry Pi")
+        # Don't spend probe attempts while the Ethernet link is still negotiating
+        if not self.wait_for_link_up(self.interface):
+            self.logger.warning(f"{self.interface} did not report link up, probing anyway")
+        
+        # Probe the SSH port instead of pinging: it answers in milliseconds
+        # and checks the exact service the file transfer relies on
+        if not self.probe_ssh_port():
+            self.logger.error("Failed to reach Crystal SSH port from Raspberry Pi")
             return False
         
         self.logger.info("Network connection test successful")
+        
+        # Open the shared SSH master now so later transfers skip the handshake
+        self.open_ssh_master()
         return True
 
-    def check_ip_exists(self, ip, interface):
-        """Check if an IP address is already assigned to the interface"""
-        success, output = self.run_command(f"ip addr show {interface}")
-        if success:
-            return ip in output
+    def wait_for_link_up(self, interface, timeout=5.0):
+        """Poll the interface state until the kernel reports it UP or timeout expires"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            success, output = self.run_command(["ip", "-o", "link", "show", interface])
+            if success and b"state UP" in output:
+                return True
+            time.sleep(0.1)
         return False
 
-    def remove_ip(self, ip, interface):
-        """Remove an IP address from the interface"""
-        if self.check_ip_exists(ip, interface):
-            success, output = self.run_command(f"sudo ip addr del {ip}/{self.netmask} dev {interface}")
-            if success:
-                self.logger.info(f"Removed existing IP {ip} from {interface}")
-                return True
-            else:
-                self.logger.error(f"Failed to remove IP {ip}: {output}")
-                return False
+    def probe_ssh_port(self, attempts=5, timeout=2.0):
+        """Return True once a TCP connection to the Crystal SSH port succeeds"""
+        for attempt in range(attempts):
+            try:
+                with socket.create_connection((self.crystal_ip, 22), timeout=timeout):
+                    return True
+            except OSError as e:
+                self.logger.debug(f"SSH port probe {attempt + 1}/{attempts} failed: {e}")
+                time.sleep(0.2)
+        return False
+
+    def open_ssh_master(self):
+        """Start the persistent SSH master connection to the Crystal board"""
+        try:
+            result = subprocess.run(
+                ["ssh", *self.ssh_options, self.ssh_target, "true"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=30
+            )
+        except subprocess.TimeoutExpired:
+            self.logger.warning("Timed out opening SSH master connection")
+            return False
+        if result.returncode != 0:
+            self.logger.warning(f"Failed to open SSH master connection: {result.stderr.strip()}")
+            return False
+        self.logger.info("SSH master connection established")
         return True
 
+    def run_remote(self, command, timeout=60):
+        """Run a shell command on the Crystal over SSH; returns (exit status or None, output bytes)"""
+        try:
+            result = subprocess.run(
+                ["ssh", *self.ssh_options, self.ssh_target, command],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"Remote command timed out after {timeout} s: {command}")
+            return None, b""
+        # ssh reserves exit status 255 for its own connection errors
+        if result.returncode == 255:
+            self.logger.error(f"SSH to Crystal failed: {result.stdout.decode(errors='replace').strip()}")
+            return None, result.stdout
+        return result.returncode, result.stdout
+
+    def close_ssh_master(self):
+        """Tear down the persistent SSH master connection if it is running"""
+        if not os.path.exists(self.ssh_control_path):
+            return
+        subprocess.run(
+            ["ssh", "-o", f"ControlPath={self.ssh_control_path}", "-O", "exit", self.ssh_target],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self.logger.info("SSH master connection closed")
+
     def transfer_files(self):
-        """Transfer both image and bmap files using SCP"""
+        """Transfer both image and bmap files in one tar stream over SSH"""
         self.logger.info("Starting file transfer to Crystal board...")
         
-        # Check if files exist and get their sizes
-        files_to_transfer = {
-            'Image file': self.image_file,
-            'BMAP file': self.bmap_file,
-            'SSH key': self.key_file
-        }
-        
-        file_sizes = {}
-        for file_desc, filepath in files_to_transfer.items():
-            if not os.path.exists(filepath):
-                self.logger.error(f"{file_desc} not found at: {filepath}")
-                return False
-            if file_desc != 'SSH key':
-                size_bytes = os.path.getsize(filepath)
-                size_mb = size_bytes / (1024 * 1024)
-                file_sizes[filepath] = size_mb
-                self.logger.info(f"{file_desc} size: {size_mb:.2f} MB")
-            
+        file_sizes = self.prepare_assets()
+        if file_sizes is None:
+            return False
         self.logger.info(f"Using base directory: {self.base_dir}")
         
-        # Ensure key file has correct permissions
-        os.chmod(self.key_file, 0o600)
-        
-        # Transfer each file
+        # Stream both files through a single tar-over-ssh pipe so the SSH
+        # handshake and TCP slow-start are paid once for the whole transfer
         files_to_send = [self.image_file, self.bmap_file]
-        total_transferred = 0
+        filenames = [self.image_name, self.bmap_name]
+        total_size = sum(file_sizes[filepath] for filepath in files_to_send)
+        
+        self.logger.info(f"\nStarting transfer of {', '.join(filenames)} ({total_size:.2f} MB)...")
         start_time = time.time()
         
-        for filepath in files_to_send:
-            filename = os.path.basename(filepath)
-            file_size = file_sizes[filepath]
-            
-            self.logger.info(f"\nStarting transfer of {filename} ({file_size:.2f} MB)...")
-            
-            transfer_start = time.time()
-            scp_command = (
-                f"scp -v -i {self.key_file} -o StrictHostKeyChecking=no "
-                f"{filepath} {self.remote_user}@{self.crystal_ip}:{self.remote_path}"
-            )
-            
-            success, output = self.run_command(scp_command)
-            transfer_end = time.time()
-            
-            if not success:
-                self.logger.error(f"Failed to transfer {filename}: {output}")
-                return False
-            
-            # Calculate transfer statistics
-            transfer_time = transfer_end - transfer_start
-            transfer_speed = file_size / transfer_time if transfer_time > 0 else 0
-            
-            self.logger.info(f"Successfully transferred {filename}")
-            self.logger.info(f"Transfer time: {transfer_time:.2f} seconds")
-            self.logger.info(f"Transfer speed: {transfer_speed:.2f} MB/s")
-            
-            total_transferred += file_size
+        # 1 MiB records with a checkpoint per record: tar reports on stderr
+        # how many MiB it has actually fed into the pipe
+        tar_process = subprocess.Popen(
+            [
+                "tar", "-cf", "-", "--record-size=1M", "--checkpoint=1",
+                "--checkpoint-action=echo=%u", "-C", self.base_dir
+            ] + filenames,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        ssh_process = subprocess.Popen(
+            ["ssh", *self.ssh_options, self.ssh_target, f"tar -xf - -C {self.remote_path}"],
+            stdin=tar_process.stdout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        # Drop our copy of the pipe so tar gets SIGPIPE if ssh exits early
+        tar_process.stdout.close()
+        
+        tar_errors = []
+        progress_thread = threading.Thread(
+            target=self.log_transfer_progress,
+            args=(tar_process.stderr, total_size, tar_errors),
+            daemon=True
+        )
+        progress_thread.start()
+        
+        # Block on the pipe instead of polling; the progress thread does the logging
+        try:
+            _, ssh_error = ssh_process.communicate(timeout=self.transfer_timeout)
+        except subprocess.TimeoutExpired:
+            ssh_process.kill()
+            tar_process.kill()
+            ssh_process.communicate()
+            tar_process.wait()
+            progress_thread.join()
+            self.logger.error(f"File transfer timed out after {self.transfer_timeout} s")
+            return False
+        tar_process.wait()
+        progress_thread.join()
+        
+        if tar_process.returncode != 0:
+            self.logger.error(f"Failed to archive files: {' '.join(tar_errors)}")
+            return False
+        if ssh_process.returncode != 0:
+            self.logger.error(f"Failed to transfer files: {ssh_error}")
+            return False
             
         # Final statistics
         total_time = time.time() - start_time
-        avg_speed = total_transferred / total_time if total_time > 0 else 0
+        avg_speed = total_size / total_time if total_time > 0 else 0
         
         self.logger.info("\nTransfer Summary:")
-        self.logger.info(f"Total data transferred: {total_transferred:.2f} MB")
+        self.logger.info(f"Total data transferred: {total_size:.2f} MB")
         self.logger.info(f"Total time: {total_time:.2f} seconds")
         self.logger.info(f"Average transfer speed: {avg_speed:.2f} MB/s")
         
         self.logger.info("All files transferred successfully")
         return True
 
+    def prepare_assets(self):
+        """Check the image, bmap and key files once; returns image/bmap sizes in MB or None if one is missing"""
+        if self.asset_sizes is not None:
+            return self.asset_sizes
+        
+        files_to_transfer = {
+            'Image file': self.image_file,
+            'BMAP file': self.bmap_file,
+            'SSH key': self.key_file
+        }
+        
+        # One stat() per file answers both the existence and the size question
+        file_sizes = {}
+        for file_desc, filepath in files_to_transfer.items():
+            try:
+                file_stat = os.stat(filepath)
+            except FileNotFoundError:
+                self.logger.error(f"{file_desc} not found at: {filepath}")
+                return None
+            if filepath == self.key_file:
+                # ssh rejects keys readable by others; only write the inode when needed
+                if file_stat.st_mode & 0o777 != 0o600:
+                    os.chmod(self.key_file, 0o600)
+            else:
+                size_mb = file_stat.st_size / (1024 * 1024)
+                file_sizes[filepath] = size_mb
+                self.logger.info(f"{file_desc} size: {size_mb:.2f} MB")
+        
+        self.asset_sizes = file_sizes
+        return file_sizes
+
+    def log_transfer_progress(self, tar_stderr, total_size, errors):
+        """Log transfer progress in 10% steps from tar's per-MiB checkpoints; collect other stderr lines"""
+        last_step = -1
+        for raw_line in tar_stderr:
+            # Checkpoint lines are matched as bytes; only real errors get decoded
+            line = raw_line.rstrip()
+            match = TAR_CHECKPOINT_RE.match(line)
+            if not match:
+                errors.append(line.decode(errors='replace'))
+                continue
+            sent_mb = int(match.group(1))
+            percent = min(100, int(sent_mb * 100 / total_size)) if total_size > 0 else 100
+            if percent // 10 != last_step:
+                last_step = percent // 10
+                self.logger.info(f"Transfer progress: {percent}% ({sent_mb} of {total_size:.0f} MB)")
+
     def install_os(self):
         """Install OS using bmaptool and configure the system"""
         self.logger.info("Starting OS installation and configuration...")
 
-        # Install OS using bmaptool
-        self.logger.info("Installing OS using bmaptool...")
+        # Install OS using bmaptool, then update the endpoint name, sync and
+        # unmount eMMC and create device_data if missing. Everything runs as
+        # one remote script over SSH: only a bmaptool failure aborts it, the
+        # follow-up commands stay best-effort as before
         bmaptool_cmd = (
-            f"bmaptool copy --bmap {self.remote_path}{os.path.basename(self.bmap_file)} "
-            f"{self.remote_path}{os.path.basename(self.image_file)} /dev/mmcblk2"
+            f"bmaptool copy --bmap {self.remote_path}{self.bmap_name} "
+            f"{self.remote_path}{self.image_name} /dev/mmcblk2"
         )
-        
-        response = self.send_uart_command(bmaptool_cmd)
-        if not response:
-            self.logger.error("Failed to initiate OS installation")
-            return False
-        
-        # Wait for installation to complete (this might take several minutes)
-        self.logger.info("Waiting for OS installation to complete... (This may take several minutes)")
-        time.sleep(300)  # Initial wait of 5 minutes
-        
-        # Update endpoint name in node_adaptors.config
-        self.logger.info("Updating endpoint name...")
         sed_cmd = "sed -i 's/dummy-app-dev/mitre-poc/' /opt/vitro_io/node_adaptors.config"
-        response = self.send_uart_command(sed_cmd)
-        if not response:
-            self.logger.error("Failed to update endpoint name")
-            return False
-            
-        # Sync and unmount eMMC
-        self.logger.info("Syncing and unmounting eMMC...")
         sync_cmd = "sync; umount /media"
-        response = self.send_uart_command(sync_cmd)
-        if not response:
-            self.logger.error("Failed to sync and unmount eMMC")
-            return False
-            
-        # Check and create device_data file if needed
-        self.logger.info("Configuring device data...")
         check_create_cmd = (
             '[[ ! -f /opt/vitro_io/gateway/device_data ]] && '
             'echo -e "[provisioning]\\ncustomerId=testCustomer" > /opt/vitro_io/gateway/device_data'
         )
-        response = self.send_uart_command(check_create_cmd)
+        install_script = f"{bmaptool_cmd} || exit $?; {sed_cmd}; {sync_cmd}; {check_create_cmd}; exit 0"
+        
+        # Wait for installation to complete (this might take several minutes)
+        self.logger.info("Installing OS using bmaptool and configuring the system... (This may take several minutes)")
+        status, output = self.run_remote(install_script, timeout=900)
+        if status != 0:
+            self.logger.error(f"OS installation failed (exit status {status}): {output.decode(errors='replace')}")
+            return False
+        self.logger.debug(f"Installation output: {output.decode(errors='replace')}")
         
         self.logger.info("OS installation and configuration completed successfully")
         return True
@@ -359,6 +566,7 @@ class BoardSetup:
         if hasattr(self, 'uart') and self.uart and self.uart.is_open:
             self.uart.close()
             self.logger.info("UART connection closed")
+        self.close_ssh_master()
 
 class MACDatabase:
     def __init__(self, csv_path, prefix='70:b3:d5:f1:9'):
@@ -413,7 +621,11 @@ class MACSetup:
             if not os.path.exists(self.local_path):
                 self.repo = Repo.clone_from(self.repo_url, self.local_path)
             else:
+                # The clone is kept between runs (macdb.py reuses it too) and
+                # may be stale or on an old assignment branch
                 self.repo = Repo(self.local_path)
+                self.repo.remotes.origin.fetch()
+                self.repo.git.checkout('-f', '-B', 'main', 'origin/main')
             return self.repo
         except Exception as e:
             print(f"Clone failed: {e}")
@@ -496,10 +708,14 @@ class BoardSetupExtended(BoardSetup):
         self.serial_number = None
 
     def get_serial_number(self):
-        """Get serial number from the board through UART"""
-        response = self.send_uart_command("cat /proc/cpuinfo | grep Serial")
-        if response:
-            self.serial_number = response.strip().split(':')[1].strip()
+        """Get serial number from the board through UART; read once and cached for the board"""
+        if self.serial_number:
+            return self.serial_number
+        
+        response = self.send_uart_command("cat /proc/cpuinfo | grep Serial", expect=ROOT_PROMPT)
+        match = SERIAL_NUMBER_RE.search(response) if response else None
+        if match:
+            self.serial_number = match.group(1)
             return self.serial_number
         return None
 
@@ -507,10 +723,9 @@ class BoardSetupExtended(BoardSetup):
         """Handle MAC address assignment process"""
         self.logger.info("Starting MAC address assignment...")
         
-        if not self.serial_number:
-            if not self.get_serial_number():
-                self.logger.error("Failed to get serial number")
-                return False
+        if not self.get_serial_number():
+            self.logger.error("Failed to get serial number")
+            return False
         
         try:
             # Setup git and clone repo
@@ -548,7 +763,7 @@ class BoardSetupExtended(BoardSetup):
             # Write MAC address to board
             self.logger.info(f"Writing MAC address {mac_addr} to board...")
             write_cmd = f"fw_setenv ethaddr {mac_addr}"
-            response = self.send_uart_command(write_cmd)
+            response = self.send_uart_command(write_cmd, expect=ROOT_PROMPT)
             if not response:
                 self.logger.error("Failed to write MAC address to board")
                 return False
@@ -569,22 +784,28 @@ def main():
    setup = BoardSetupExtended(args.github_token, args.repo_url)
    
    try:
-       steps = [
-           ('Setup Raspberry Pi network', setup.setup_raspi_network),
-           ('Setup UART connection', setup.setup_uart_connection),
-           ('Setup Crystal network', setup.setup_crystal_network),
-           ('Test connection', setup.test_connection),
-           ('Transfer files', setup.transfer_files),
-           ('Install OS', setup.install_os),
-           ('Assign MAC address', setup.assign_mac_address)
-       ]
-       
-       for step_name, step_func in steps:
-           setup.logger.info(f"Starting: {step_name}")
-           if not step_func():
-               setup.logger.error(f"Failed at: {step_name}")
-               sys.exit(1)
-           setup.logger.info(f"Completed: {step_name}")
+       # The Pi-side network setup does not depend on the board, so run it
+       # while the UART login and Crystal network configuration proceed
+       with ThreadPoolExecutor(max_workers=1) as executor:
+           raspi_network = executor.submit(setup.setup_raspi_network)
+           
+           steps = [
+               ('Setup UART connection', setup.setup_uart_connection),
+               ('Setup Crystal network', setup.setup_crystal_network),
+               ('Setup Raspberry Pi network', raspi_network.result),
+               ('Test connection', setup.test_connection),
+               ('Transfer files', setup.transfer_files),
+               ('Install OS', setup.install_os),
+               ('Assign MAC address', setup.assign_mac_address)
+           ]
+           
+           for step_name, step_func in steps:
+               setup.logger.info(f"Starting: {step_name}")
+               step_start = time.time()
+               if not step_func():
+                   setup.logger.error(f"Failed at: {step_name} after {time.time() - step_start:.1f} s")
+                   sys.exit(1)
+               setup.logger.info(f"Completed: {step_name} in {time.time() - step_start:.1f} s")
            
        setup.logger.info("Setup completed successfully")
        
@@ -596,7 +817,4 @@ def main():
        setup.cleanup()
 
 if __name__ == "__main__":
-   main()
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+   main()
\ No newline at end of file
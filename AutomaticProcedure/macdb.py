@@ -3,7 +3,6 @@ import os
 import csv
 import uuid
 import logging
-import shutil
 from git import Repo
 import subprocess
 
@@ -16,6 +15,9 @@ class MACDatabase:
         
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.board_info_path = os.path.join(self.script_dir, "boardInfo.txt")
+        # db.csv rows, loaded once per sync and indexed by MAC address
+        self.rows = None
+        self.rows_by_mac = {}
         self.setup_git()
 
     def setup_git(self):
@@ -35,27 +37,27 @@ class MACDatabase:
 
     def sync_and_verify_db(self):
         try:
-            cmd = f'cd {self.local_path} && git fetch && git reset --hard origin/main'
-            subprocess.run(cmd, shell=True)
+            # In-process through GitPython instead of a shell per git command
+            self.repo.remotes.origin.fetch()
+            # The clone is kept between runs and may still be on the last
+            # assignment branch, so move main onto origin/main and check it out
+            self.repo.git.checkout('-f', '-B', 'main', 'origin/main')
+            self.load_db()
             return True
         except Exception as e:
             self.logger.error(f"Failed to sync DB: {e}")
             return False
 
+    def load_db(self):
+        csv_path = os.path.join(self.local_path, 'db.csv')
+        with open(csv_path, 'r') as f:
+            self.rows = list(csv.reader(f))
+        self.rows_by_mac = {row[0]: row for row in self.rows if row}
+
     def get_available_mac(self):
         if not self.sync_and_verify_db():
             return None
-        try:
-            csv_path = os.path.join(self.local_path, 'db.csv')
-            with open(csv_path, 'r') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[1] == '0':
-                        return row[0]
-            return None
-        except Exception as e:
-            self.logger.error(f"Error reading MAC database: {e}")
-            return None
+        return next((row[0] for row in self.rows if len(row) > 1 and row[1] == '0'), None)
 
     def read_serial_number(self):
         try:
@@ -69,15 +71,12 @@ class MACDatabase:
 
     def verify_pr_changes(self, branch_name):
         try:
-            cmd = f'cd {self.local_path} && git diff origin/main..{branch_name} --numstat'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                changes = result.stdout.strip().split('\t')
-                if len(changes) == 3:
-                    additions = int(changes[0])
-                    deletions = int(changes[1])
-                    return changes[2] == 'db.csv' and additions == 1 and deletions == 1
+            numstat = self.repo.git.diff(f'origin/main..{branch_name}', numstat=True)
+            changes = numstat.strip().split('\t')
+            if len(changes) == 3:
+                additions = int(changes[0])
+                deletions = int(changes[1])
+                return changes[2] == 'db.csv' and additions == 1 and deletions == 1
             return False
         except Exception as e:
             self.logger.error(f"Failed to verify PR changes: {e}")
@@ -95,14 +94,16 @@ class MACDatabase:
 
     def create_pull_request(self, branch_name, mac_addr, serial):
         try:
-            cmd = f'cd {self.local_path} && git push origin {branch_name}'
-            subprocess.run(cmd, shell=True)
-            
-            cmd = f'cd {self.local_path} && gh pr create --title "Assign MAC {mac_addr} to {serial}" ' \
-                  f'--body "Automated MAC address assignment for board {serial}" ' \
-                  f'--base main --head {branch_name}'
+            self.repo.remotes.origin.push(branch_name)
             
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            # Only the PR itself needs gh; pass argv directly so no shell is spawned
+            cmd = [
+                'gh', 'pr', 'create',
+                '--title', f'Assign MAC {mac_addr} to {serial}',
+                '--body', f'Automated MAC address assignment for board {serial}',
+                '--base', 'main', '--head', branch_name
+            ]
+            result = subprocess.run(cmd, cwd=self.local_path, capture_output=True, text=True)
             if result.returncode == 0:
                 pr_url = result.stdout.strip()
                 pr_number = pr_url.split('/')[-1]
@@ -114,25 +115,13 @@ class MACDatabase:
 
     def merge_pull_request(self, pr_number):
         try:
-            cmd = f'cd {self.local_path} && gh pr merge {pr_number} --merge --delete-branch'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                self.cleanup_local_repo()
+            cmd = ['gh', 'pr', 'merge', str(pr_number), '--merge', '--delete-branch']
+            result = subprocess.run(cmd, cwd=self.local_path, capture_output=True, text=True)
             return result.returncode == 0
         except Exception as e:
             self.logger.error(f"PR merge failed: {e}")
             return False
 
-    def cleanup_local_repo(self):
-        try:
-            if os.path.exists(self.local_path):
-                shutil.rmtree(self.local_path)
-                self.logger.info("Cleaned up local repository")
-            return True
-        except Exception as e:
-            self.logger.error(f"Failed to cleanup repository: {e}")
-            return False
-
     def update_board_info(self, serial, mac_addr):
         try:
             with open(self.board_info_path, 'w') as f:
@@ -149,23 +138,17 @@ class MACDatabase:
             if not branch_name:
                 return False
 
-            csv_path = os.path.join(self.local_path, 'db.csv')
-            rows = []
-            updated = False
-
-            with open(csv_path, 'r') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row[0] == mac_addr:
-                        rows.append([mac_addr, serial])
-                        updated = True
-                    else:
-                        rows.append(row)
+            if self.rows is None:
+                self.load_db()
 
-            if updated:
+            # Update the row in place and write the whole file back once
+            row = self.rows_by_mac.get(mac_addr)
+            if row:
+                row[1] = serial
+                csv_path = os.path.join(self.local_path, 'db.csv')
                 with open(csv_path, 'w', newline='') as f:
                     writer = csv.writer(f)
-                    writer.writerows(rows)
+                    writer.writerows(self.rows)
 
                 self.repo.index.add(['db.csv'])
                 self.repo.index.commit(f"Mark MAC {mac_addr} as used by {serial}")
@@ -2,27 +2,137 @@ import serial
 import time
 import logging
 import sys
+import os
+import glob
+import fcntl
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from macdb import MACDatabase
 
+# U-Boot fuse command markers, matched against raw UART bytes
+FUSE_CONFIRM_PROMPT = b"Really perform this fuse programming? <y/N>"
+FUSE_PROGRAMMED = b"Programming bank 4 word"
+UNKNOWN_COMMAND = b"Unknown command"
+COMMAND_QUOTE = b"command '"
+UBOOT_PROMPT = b"=> "
+BOOT_ENV_LOADED = b"Loading Environment from MMC... OK"
+
+# Linux serial driver ioctls (struct serial_struct, flags field at offset 16)
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 0x2000
+TIOCEXCL = 0x540C
+
+def set_low_latency(port, logger):
+    """
+    Ask the serial driver behind an open pyserial port to deliver received
+    bytes without batching them. Shared with AutoSetup.py.
+    Drivers without TIOCSSERIAL support are left unchanged.
+    """
+    try:
+        serial_info = bytearray(fcntl.ioctl(port.fileno(), TIOCGSERIAL, bytes(72)))
+        flags = struct.unpack_from("i", serial_info, 16)[0]
+        struct.pack_into("i", serial_info, 16, flags | ASYNC_LOW_LATENCY)
+        fcntl.ioctl(port.fileno(), TIOCSSERIAL, bytes(serial_info))
+        logger.debug(f"Enabled low-latency mode on {port.port}")
+        return True
+    except OSError as e:
+        logger.debug(f"Low-latency mode not available on {port.port}: {e}")
+        return False
+
+def read_until(port, expected, timeout):
+    """
+    Block until `expected` arrives on the pyserial `port` or `timeout`
+    seconds elapse. Returns the raw bytes received. Shared with AutoSetup.py.
+    """
+    previous_timeout = port.timeout
+    port.timeout = timeout
+    try:
+        return port.read_until(expected)
+    finally:
+        port.timeout = previous_timeout
+
+def find_port_users(device):
+    """
+    Return ("name (pid)" entries for other processes that have `device` open,
+    number of processes whose fd table we are not allowed to read), found by
+    resolving /proc/<pid>/fd links.
+    """
+    device = os.path.realpath(device)
+    users = []
+    hidden = 0
+    for fd_dir in glob.glob("/proc/[0-9]*/fd"):
+        pid = int(fd_dir.split("/")[2])
+        if pid == os.getpid():
+            continue
+        try:
+            fds = os.listdir(fd_dir)
+        except PermissionError:
+            hidden += 1
+            continue
+        except OSError:
+            # The process exited while we were scanning
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target == device:
+                try:
+                    with open(f"/proc/{pid}/comm") as f:
+                        name = f.read().strip()
+                except OSError:
+                    name = "?"
+                users.append(f"{name} ({pid})")
+                break
+    return users, hidden
+
+def claim_port(port, logger):
+    """
+    Make sure no other process shares the open pyserial `port`.
+    pyserial's exclusive=True is only an advisory flock, which keeps out other
+    pyserial/flock users but not plain open() users such as getty or
+    ModemManager. So check /proc for processes that already have the device
+    open, then set TIOCEXCL so later open() calls by non-root processes fail.
+    Without root, processes of other users (e.g. a root agetty) cannot be
+    inspected, and TIOCEXCL never stops root openers, so that case is only
+    warned about.
+    Returns False if another process is known to hold the device.
+    """
+    users, hidden = find_port_users(port.port)
+    if users:
+        logger.error(f"{port.port} is already open by: {', '.join(users)}; stop them before retrying")
+        return False
+    if hidden:
+        logger.warning(
+            f"Could not inspect the open files of {hidden} processes owned by other users; "
+            f"if getty or ModemManager uses {port.port}, stop it or run as root for a full check"
+        )
+    try:
+        fcntl.ioctl(port.fileno(), TIOCEXCL)
+    except OSError as e:
+        logger.debug(f"Could not set TIOCEXCL on {port.port}: {e}")
+    return True
+
+@lru_cache(maxsize=256)
 def convert_mac_to_fuse_values(mac_str):
     """
     Convert a MAC address string (e.g. "ab:cd:ef:12:34:56")
     into two integers:
       - high (16-bit): representing the first two bytes (ab and cd)
       - low (32-bit): representing the remaining four bytes (ef,12,34,56)
+    Raises ValueError on malformed input so failures are never cached.
     """
-    try:
-        parts = mac_str.split(':')
-        if len(parts) != 6:
-            raise ValueError("Invalid MAC address format")
-        # Concatenate first two bytes for high part
-        high = int(parts[0] + parts[1], 16)
-        # Concatenate the remaining four bytes for low part
-        low = int(parts[2] + parts[3] + parts[4] + parts[5], 16)
-        return high, low
-    except Exception as e:
-        logging.error(f"MAC conversion error: {e}")
-        return None, None
+    parts = mac_str.split(':')
+    if len(parts) != 6:
+        raise ValueError("Invalid MAC address format")
+    # Concatenate first two bytes for high part
+    high = int(parts[0] + parts[1], 16)
+    # Concatenate the remaining four bytes for low part
+    low = int(parts[2] + parts[3] + parts[4] + parts[5], 16)
+    return high, low
 
 class UARTFlasher:
     def __init__(self, port="/dev/ttyAMA0", baudrate=115200):
@@ -36,7 +146,14 @@ class UARTFlasher:
 
     def setup_uart(self):
         try:
-            self.uart = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=1)
+            self.uart = serial.Serial(
+                port=self.port, baudrate=self.baudrate, timeout=1, write_timeout=2,
+                exclusive=True, rtscts=False, dsrdtr=False, xonxoff=False
+            )
+            if not claim_port(self.uart, self.logger):
+                self.uart.close()
+                return False
+            set_low_latency(self.uart, self.logger)
             self.logger.info(f"UART opened on {self.port}")
             return True
         except Exception as e:
@@ -45,85 +162,131 @@ class UARTFlasher:
 
     def read_uart(self, timeout=1):
         """
-        Read from UART with improved buffering and response detection.
+        Read from UART until a known U-Boot response marker or the prompt
+        arrives, or `timeout` seconds elapse.
+        Bytes are accumulated in place in a bytearray and returned as raw
+        bytes; callers decode only for logging.
         """
         end_time = time.time() + timeout
-        buffer = ""
-        while time.time() < end_time:
-            if self.uart.in_waiting:
-                # Read chunks instead of single chars for better performance
-                chunk = self.uart.read(self.uart.in_waiting).decode(errors='ignore')
+        buffer = bytearray()
+        programmed = -1
+        previous_timeout = self.uart.timeout
+        # Short blocking reads wake up on the first byte instead of polling in_waiting
+        self.uart.timeout = 0.05
+        try:
+            while time.time() < end_time:
+                chunk = self.uart.read(self.uart.in_waiting or 1)
+                if not chunk:
+                    continue
                 buffer += chunk
+                # Earlier bytes were already scanned; only the new chunk plus
+                # room for a marker split across two reads needs checking
+                scan_from = max(0, len(buffer) - len(chunk) - len(FUSE_CONFIRM_PROMPT))
                 
                 # Check for various important response patterns
-                if "Really perform this fuse programming? <y/N>" in buffer:
-                    # Give extra time for the full prompt to arrive
-                    time.sleep(0.2)
-                    return buffer + self.uart.read(self.uart.in_waiting).decode(errors='ignore')
+                if buffer.find(FUSE_CONFIRM_PROMPT, scan_from) >= 0:
+                    return bytes(buffer)
                     
                 # Check for error conditions
-                if "Unknown command" in buffer or "command '" in buffer:
-                    return buffer
+                if buffer.find(UNKNOWN_COMMAND, scan_from) >= 0 or buffer.find(COMMAND_QUOTE, scan_from) >= 0:
+                    return bytes(buffer)
                     
-                # Check for successful programming confirmation
-                if "Programming bank 4 word" in buffer:
-                    # Give extra time for completion
-                    time.sleep(0.2)
-                    return buffer + self.uart.read(self.uart.in_waiting).decode(errors='ignore')
-                    
-            # Small sleep to prevent CPU spinning
-            time.sleep(0.01)
-        return buffer
+                # Check for successful programming confirmation; the line is
+                # complete once its trailing newline has arrived
+                if programmed < 0:
+                    programmed = buffer.find(FUSE_PROGRAMMED, scan_from)
+                if programmed >= 0 and buffer.find(b"\n", programmed) >= 0:
+                    return bytes(buffer)
+                
+                # Any other command is finished once U-Boot prints its prompt again
+                if buffer.endswith(UBOOT_PROMPT):
+                    return bytes(buffer)
+        finally:
+            self.uart.timeout = previous_timeout
+        return bytes(buffer)
 
     def wait_for_boot_prompt(self, timeout=30):
         self.logger.info("Waiting for boot prompt...")
-        start_time = time.time()
-        while (time.time() - start_time) < timeout:
-            response = self.read_uart()
-            if response:
-                self.logger.info(f"Boot: {response}")
-                if "Loading Environment from MMC... OK" in response:
-                    self.logger.info("Sending interrupt...")
-                    self.uart.write(b' ')
-                    time.sleep(0.5)
-                    return True
-        return False
+        response = read_until(self.uart, BOOT_ENV_LOADED, timeout)
+        if response:
+            self.logger.info(f"Boot: {response.decode(errors='ignore')}")
+        if response.find(BOOT_ENV_LOADED) < 0:
+            return False
+
+        self.logger.info("Sending interrupt...")
+        self.uart.write(b' ')
+        # Autoboot is aborted by the buffered key; wait for the shell prompt
+        read_until(self.uart, UBOOT_PROMPT, timeout=5)
+        return True
 
     def send_command(self, command, wait_for_confirmation=False):
         """
         Sends a command over UART and returns the response.
         If wait_for_confirmation is True, it will handle the interactive prompt.
         """
-        # Clear any pending input
-        self.uart.reset_input_buffer()
-        
-        # Send command with proper line ending
-        self.uart.write(f"{command}\r\n".encode())
-        self.uart.flush()
-        time.sleep(1)  # Increased delay to ensure command is processed
-        
-        response = self.read_uart(timeout=2)  # Increased timeout
-        if not response:
-            return None
-
-        # Handle the confirmation prompt if expected
-        if wait_for_confirmation and "Really perform this fuse programming? <y/N>" in response:
-            self.logger.info("Sending confirmation for fuse programming...")
-            self.uart.write(b'y\r\n')
-            self.uart.flush()
-            time.sleep(1)  # Increased delay after confirmation
-            final_response = self.read_uart(timeout=2)
-            response += final_response
+        try:
+            # Clear any pending input
+            self.uart.reset_input_buffer()
             
-            # Verify the command wasn't split
-            if "Unknown command" in response or "command '" in response:
-                self.logger.error("Command was corrupted during transmission")
+            # Send command with proper line ending
+            self.uart.write(f"{command}\r\n".encode())
+            
+            # read_uart returns as soon as the reply is complete, so the old
+            # fixed 1 s delay is folded into the timeout (e.g. for saveenv)
+            response = self.read_uart(timeout=3)
+            if not response:
                 return None
 
+            # Handle the confirmation prompt if expected
+            if wait_for_confirmation and response.find(FUSE_CONFIRM_PROMPT) >= 0:
+                self.logger.info("Sending confirmation for fuse programming...")
+                self.uart.write(b'y\r\n')
+                final_response = self.read_uart(timeout=3)
+                response += final_response
+            
+                # Verify the command wasn't split
+                if response.find(UNKNOWN_COMMAND) >= 0 or response.find(COMMAND_QUOTE) >= 0:
+                    self.logger.error("Command was corrupted during transmission")
+                    return None
+        except serial.SerialException as e:
+            # Includes SerialTimeoutException from a write stalled past write_timeout
+            self.logger.error(f"UART error while sending '{command}': {e}")
+            return None
+
         if response:
-            self.logger.info(f"Command: {command}\nResponse: {response}")
+            self.logger.info(f"Command: {command}\nResponse: {response.decode(errors='ignore')}")
         return response
 
+    def program_fuse_words(self, start_word, values):
+        """
+        Programs consecutive bank 4 fuse words with a single non-interactive
+        `fuse prog -y` command and waits for the prompt to return.
+        Returns the set of word indexes U-Boot confirmed as programmed.
+        """
+        hex_values = " ".join(f"0x{value:08x}" for value in values)
+        command = f"fuse prog -y 4 {start_word} {hex_values}"
+
+        try:
+            self.uart.reset_input_buffer()
+            self.uart.write(f"{command}\r\n".encode())
+            response = read_until(self.uart, UBOOT_PROMPT, timeout=3)
+        except serial.SerialException as e:
+            self.logger.error(f"UART error while sending '{command}': {e}")
+            return set()
+        self.logger.info(f"Command: {command}\nResponse: {response.decode(errors='ignore')}")
+
+        if response.find(UNKNOWN_COMMAND) >= 0 or response.find(COMMAND_QUOTE) >= 0:
+            self.logger.warning("Combined fuse command was not accepted")
+            return set()
+
+        confirmed = set()
+        for word in range(start_word, start_word + len(values)):
+            if response.find(FUSE_PROGRAMMED + f" 0x{word:08x}".encode()) >= 0:
+                confirmed.add(word)
+        if len(confirmed) != len(values):
+            self.logger.warning("Combined fuse command incomplete; programming remaining words one by one")
+        return confirmed
+
     def write_mac_address(self, mac_addr):
         """
         Programs the MAC fuses with the given MAC address.
@@ -131,24 +294,29 @@ class UARTFlasher:
         Returns True only if both fuse programmings are confirmed successful.
         """
         self.logger.info(f"Attempting to flash MAC: {mac_addr}")
-        high, low = convert_mac_to_fuse_values(mac_addr)
-        if high is None or low is None:
-            self.logger.error("MAC conversion failed.")
+        try:
+            high, low = convert_mac_to_fuse_values(mac_addr)
+        except ValueError as e:
+            self.logger.error(f"MAC conversion failed: {e}")
             return False
 
-        # Program low fuse value first (4 bytes)
-        cmd_low = f"fuse prog 4 2 0x{low:08x}"
-        low_result = self.send_command(cmd_low, wait_for_confirmation=True)
-        if not low_result or "Programming bank 4 word" not in low_result:
-            self.logger.error("Failed to program low fuse value")
-            return False
+        # Program low (4 bytes) and high (2 bytes) fuse words in one round-trip
+        confirmed = self.program_fuse_words(2, [low, high])
 
-        # Program high fuse value (2 bytes)
-        cmd_high = f"fuse prog 4 3 0x{high:04x}"
-        high_result = self.send_command(cmd_high, wait_for_confirmation=True)
-        if not high_result or "Programming bank 4 word" not in high_result:
-            self.logger.error("Failed to program high fuse value")
-            return False
+        # Fall back to one interactive command per word for anything unconfirmed
+        if 2 not in confirmed:
+            cmd_low = f"fuse prog 4 2 0x{low:08x}"
+            low_result = self.send_command(cmd_low, wait_for_confirmation=True)
+            if not low_result or low_result.find(FUSE_PROGRAMMED) < 0:
+                self.logger.error("Failed to program low fuse value")
+                return False
+
+        if 3 not in confirmed:
+            cmd_high = f"fuse prog 4 3 0x{high:04x}"
+            high_result = self.send_command(cmd_high, wait_for_confirmation=True)
+            if not high_result or high_result.find(FUSE_PROGRAMMED) < 0:
+                self.logger.error("Failed to program high fuse value")
+                return False
 
         # After successful fuse programming, set the MAC in U-Boot environment
         self.logger.info("MAC address successfully programmed to fuses. Setting environment variables...")
@@ -185,12 +353,25 @@ def main():
         if not uart.setup_uart():
             sys.exit(1)
 
-        mac_addr = uart.mac_db.get_available_mac()
+        # Fetch the next free MAC from the database while the board boots
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            mac_future = executor.submit(uart.mac_db.get_available_mac)
+
+            # Without a free MAC there is nothing to flash: interrupt the
+            # blocking boot wait so the error is reported right away
+            def abort_boot_wait(future):
+                if future.exception() is not None or not future.result():
+                    uart.uart.cancel_read()
+
+            mac_future.add_done_callback(abort_boot_wait)
+            in_uboot = uart.wait_for_boot_prompt()
+            mac_addr = mac_future.result()
+
         if not mac_addr:
             uart.logger.error("No available MAC address found")
             sys.exit(1)
 
-        if uart.wait_for_boot_prompt():
+        if in_uboot:
             uart.logger.info("Successfully entered U-Boot")
             # Write MAC address and verify success before updating database
             if uart.write_mac_address(mac_addr):